@@ -15,6 +15,10 @@ class Settings(BaseSettings):
     SERPAPI_MIN_INTERVAL: float = 1.0  # seconds between requests
     SERPAPI_MAX_RETRIES: int = 2
     SERPAPI_BACKOFF_FACTOR: float = 1.5
+    # On-disk result cache: nutrition queries are stable for hours, and a
+    # disk hit survives restarts that wipe the in-RAM LRU.
+    SERPAPI_CACHE_DIR: str = ".serpapi_cache"
+    SERPAPI_CACHE_TTL: int = 6 * 3600  # seconds
 
     # Application Settings
     APP_NAME: str = "Food Agent Server"
@@ -22,13 +26,38 @@ class Settings(BaseSettings):
     LOG_LEVEL: str = "INFO"
 
     # Local Failsafe Models
+    # Quantization: Q4_K_M (4-bit weight-only) is the default for both models.
+    # CPU decode is memory-bandwidth-bound, so halving bytes-per-weight vs Q8_0
+    # roughly doubles tokens/sec with negligible quality loss. If accuracy
+    # regresses noticeably, swap the filenames for the Q5_K_M variants.
     LOCAL_MODEL_LIGHT_REPO: str = "moondream/moondream2-gguf"
-    LOCAL_MODEL_LIGHT_FILENAME: str = "moondream2-q4_k.gguf" 
-    
+    LOCAL_MODEL_LIGHT_FILENAME: str = "moondream2-Q4_K_M.gguf"
+    # Vision projector for Moondream; the language GGUF alone cannot see
+    # images, so the light path needs this passed as clip_model_path.
+    LOCAL_MODEL_LIGHT_MMPROJ_FILENAME: str = "moondream2-mmproj-f16.gguf"
+
     LOCAL_MODEL_HEAVY_REPO: str = "abetlen/Phi-3.5-vision-instruct-gguf"
     LOCAL_MODEL_HEAVY_FILENAME: str = "Phi-3.5-vision-instruct-Q4_K_M.gguf"
     
     LOCAL_MODELS_DIR: str = "local_models"
+    # A GGUF smaller than this is assumed to be a truncated download and
+    # is re-fetched instead of being used as-is.
+    LOCAL_MODEL_MIN_BYTES: int = 1_000_000
+
+    # Warm both GGUFs into the page cache at startup (parallel NVMe reads)
+    # so toggling deep_search never pays a cold disk read. Skipped when
+    # available RAM is insufficient for both files.
+    PREFETCH_BOTH_MODELS: bool = True
+
+    # Keep both Llama instances resident instead of unloading the inactive
+    # one on every deep_search toggle. Both Q4_K_M models fit in ~5GB; the
+    # inactive model is still evicted if free RAM drops below the margin.
+    LOCAL_MODEL_KEEP_BOTH: bool = True
+    LOCAL_MODEL_KEEP_BOTH_MIN_FREE_MB: int = 4096
+
+    # Layers to offload to GPU (CUDA/Metal builds of llama-cpp-python).
+    # 0 keeps everything on CPU; -1 offloads all layers.
+    N_GPU_LAYERS: int = 0
 
     # AI Model Configuration
     # Prioritized list based on research (Nov 2025 availability)
@@ -1,23 +1,172 @@
+import asyncio
+import base64
+import mmap
 import os
+import sys
+import threading
 from huggingface_hub import hf_hub_download
 from loguru import logger
 from app.config import settings
-import json
+import orjson
+
+def _extract_first_json_object(content: bytes):
+    """Returns the first balanced top-level JSON object in content, or None.
+
+    One O(n) pass tracking brace depth plus in-string/escape state, so
+    braces inside string values (or stray closing braces in the model's
+    surrounding reasoning) can't corrupt the extracted span the way a
+    find('{')/rfind('}') slice could.
+    """
+    start = content.find(b"{")
+    if start == -1:
+        return None
+
+    depth = 0
+    in_string = False
+    escape = False
+    for i in range(start, len(content)):
+        b = content[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif b == 0x5C:  # backslash
+                escape = True
+            elif b == 0x22:  # '"'
+                in_string = False
+        elif b == 0x22:
+            if depth:
+                in_string = True
+        elif b == 0x7B:  # '{'
+            depth += 1
+        elif b == 0x7D and depth:  # '}'
+            depth -= 1
+            if depth == 0:
+                return content[start:i + 1]
+    return None
+
+# llama-cpp stays a lazy import so merely importing this module (e.g. for
+# the happy cloud path) never loads the native library — but once the
+# failsafe triggers we resolve it exactly once instead of re-entering the
+# import machinery on every _load_model call.
+_llama_imports = None
+_llama_import_lock = threading.RLock()
+
+def _get_llama_imports():
+    """Returns (Llama, MoondreamChatHandler), importing llama_cpp on first use."""
+    global _llama_imports
+    if _llama_imports is None:
+        with _llama_import_lock:
+            if _llama_imports is None:
+                from llama_cpp import Llama
+                from llama_cpp.llama_chat_format import MoondreamChatHandler
+                _llama_imports = (Llama, MoondreamChatHandler)
+    return _llama_imports
+
+# Kept byte-identical across calls so the llama.cpp prompt cache can reuse
+# the system prompt's KV prefix instead of re-prefilling it every request.
+SYSTEM_PROMPT = (
+    "You are a food AI. Identify food items and estimate calories. "
+    "Return JSON with keys: 'overall_description', 'items' (list of {name, nutrition}), 'total_calories_estimate'. "
+    "Keep description brief."
+)
 
 class LocalIntelligenceClient:
     def __init__(self):
         self.models_dir = os.path.join(os.getcwd(), settings.LOCAL_MODELS_DIR)
         os.makedirs(self.models_dir, exist_ok=True)
         
-        self.light_model = None
-        self.heavy_model = None
-        
+        # Loaded Llama instances keyed by "light"/"heavy". With
+        # LOCAL_MODEL_KEEP_BOTH both stay resident (if RAM allows) so
+        # deep_search toggles don't re-read gigabytes from disk.
+        self._models = {}
+
+        # mmap handles kept alive so the kernel keeps GGUF pages resident
+        self._prefetch_mm = {}
+
+        # Serializes _load_model so concurrent requests can't double-load
+        self._load_lock = asyncio.Lock()
+
+        # (repo_id, filename) -> resolved local path, so model swaps never
+        # repeat the Hub lookup
+        self._resolved_paths = {}
+
         # We don't load models at init to save RAM until needed
 
+    def warmup_prefetch(self):
+        """Concurrently warm both GGUFs into the page cache at service start.
+
+        Parallel reads saturate NVMe multi-queue bandwidth far better than a
+        single sequential stream, and keeping both files resident makes the
+        deep_search model swap near-instant. Only models already on disk are
+        touched (no downloads), and the whole thing is skipped when available
+        RAM cannot comfortably hold both files.
+        """
+        import concurrent.futures
+
+        import psutil
+
+        if not settings.PREFETCH_BOTH_MODELS:
+            return
+
+        candidates = []
+        for filename in (settings.LOCAL_MODEL_LIGHT_FILENAME, settings.LOCAL_MODEL_HEAVY_FILENAME):
+            path = os.path.join(self.models_dir, filename)
+            if os.path.isfile(path):
+                candidates.append(path)
+
+        if not candidates:
+            logger.info("No local GGUF files on disk yet; skipping warmup prefetch.")
+            return
+
+        total_size = sum(os.path.getsize(p) for p in candidates)
+        if psutil.virtual_memory().available < total_size * 1.2:
+            logger.warning("Insufficient free RAM to prefetch both models; skipping warmup.")
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+            mms = list(pool.map(self._prefetch_pages, candidates))
+
+        for path, mm in zip(candidates, mms):
+            if mm is None:
+                continue
+            model_type = "heavy" if path.endswith(settings.LOCAL_MODEL_HEAVY_FILENAME) else "light"
+            self._prefetch_mm[model_type] = mm
+
+    def _prefetch_pages(self, path: str):
+        """Force the GGUF file into the page cache so first inference pays
+        compute only, not lazy mmap disk faults. Returns the mmap object,
+        which must stay alive for the pages to remain resident."""
+        try:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                if sys.platform.startswith("linux"):
+                    # MAP_POPULATE blocks until all pages are read in
+                    mm = mmap.mmap(
+                        fd, 0,
+                        prot=mmap.PROT_READ,
+                        flags=mmap.MAP_SHARED | mmap.MAP_POPULATE
+                    )
+                else:
+                    # macOS etc.: hint the kernel, then touch a byte per page
+                    mm = mmap.mmap(fd, 0, prot=mmap.PROT_READ, flags=mmap.MAP_SHARED)
+                    if hasattr(mm, "madvise"):
+                        mm.madvise(mmap.MADV_WILLNEED)
+                    for i in range(0, len(mm), 4096):
+                        _ = mm[i]
+            finally:
+                os.close(fd)
+            logger.info(f"Prefetched {os.path.basename(path)} into page cache")
+            return mm
+        except Exception as e:
+            # Prefetch is best-effort; inference still works without it
+            logger.warning(f"Page-cache prefetch failed for {path}: {e}")
+            return None
+
     def ensure_models_available(self, download_missing: bool = False) -> bool:
         """Checks for required local GGUF files. Optionally downloads if missing."""
         required = [
             (settings.LOCAL_MODEL_LIGHT_REPO, settings.LOCAL_MODEL_LIGHT_FILENAME),
+            (settings.LOCAL_MODEL_LIGHT_REPO, settings.LOCAL_MODEL_LIGHT_MMPROJ_FILENAME),
             (settings.LOCAL_MODEL_HEAVY_REPO, settings.LOCAL_MODEL_HEAVY_FILENAME),
         ]
 
@@ -44,73 +193,144 @@ class LocalIntelligenceClient:
         return True
 
     def _get_model_path(self, repo_id: str, filename: str) -> str:
-        """Downloads model if missing and returns path."""
+        """Downloads model if missing and returns path.
+
+        The failsafe exists precisely for when the network is unreliable, so
+        the Hub is only contacted when the file is genuinely absent:
+        hf_hub_download issues an ETag HEAD request even on cache hits, which
+        adds latency and an external dependency to every model swap.
+        """
+        key = (repo_id, filename)
+        cached = self._resolved_paths.get(key)
+        if cached:
+            return cached
+
+        local_path = os.path.join(self.models_dir, filename)
+        if os.path.isfile(local_path) and os.path.getsize(local_path) > settings.LOCAL_MODEL_MIN_BYTES:
+            self._resolved_paths[key] = local_path
+            return local_path
+
         try:
             logger.info(f"Checking for local model: {filename} in {repo_id}")
             model_path = hf_hub_download(
                 repo_id=repo_id,
                 filename=filename,
                 local_dir=self.models_dir,
-                local_dir_use_symlinks=False
+                local_dir_use_symlinks=False,
+                etag_timeout=2.0  # a flaky Hub must not stall the failsafe
             )
+            self._resolved_paths[key] = model_path
             return model_path
         except Exception as e:
             logger.error(f"Failed to download model {filename}: {e}")
             raise
 
+    def _can_keep_both(self) -> bool:
+        """Keep-warm policy: hold both models only when configured AND free
+        RAM is above the safety margin at load time."""
+        if not settings.LOCAL_MODEL_KEEP_BOTH:
+            return False
+
+        import psutil
+
+        min_free = settings.LOCAL_MODEL_KEEP_BOTH_MIN_FREE_MB * 1024 * 1024
+        return psutil.virtual_memory().available > min_free
+
     def _load_model(self, model_type: str):
-        """Lazy loads the specific model type, unloading others to save RAM."""
-        from llama_cpp import Llama
-        from llama_cpp.llama_chat_format import MoondreamChatHandler, Llava15ChatHandler
+        """Lazy loads the specific model type. The inactive model is kept
+        resident under the keep-warm policy, otherwise unloaded to save RAM."""
+        Llama, MoondreamChatHandler = _get_llama_imports()
+
+        if self._models.get(model_type):
+            return
+
+        # Evict the other model unless keep-warm applies. With only two
+        # models, the one NOT being requested is by definition the least
+        # recently needed.
+        other_type = "heavy" if model_type == "light" else "light"
+        if self._models.get(other_type) and not self._can_keep_both():
+            logger.info(f"Unloading {other_type.capitalize()} Model to free RAM...")
+            del self._models[other_type]
 
         if model_type == "light":
-            if self.light_model: return
-            
-            # Unload heavy if loaded
-            if self.heavy_model:
-                logger.info("Unloading Heavy Model to free RAM...")
-                del self.heavy_model
-                self.heavy_model = None
-            
             logger.info("Loading Light Model (Moondream)...")
             path = self._get_model_path(settings.LOCAL_MODEL_LIGHT_REPO, settings.LOCAL_MODEL_LIGHT_FILENAME)
-            
-            self.light_model = Llama(
+
+            # Moondream's vision projector lives in a separate mmproj GGUF;
+            # the handler needs that file (NOT the language GGUF) as
+            # clip_model_path, and must be passed into Llama for the image
+            # content in the chat messages to be processed at all.
+            mmproj_path = self._get_model_path(
+                settings.LOCAL_MODEL_LIGHT_REPO, settings.LOCAL_MODEL_LIGHT_MMPROJ_FILENAME
+            )
+            chat_handler = MoondreamChatHandler(clip_model_path=mmproj_path, verbose=False)
+
+            self._models["light"] = Llama(
                 model_path=path,
+                chat_handler=chat_handler,
                 n_ctx=2048,
-                n_gpu_layers=0,
+                n_gpu_layers=settings.N_GPU_LAYERS,
+                n_threads=max(1, (os.cpu_count() or 2) // 2),
                 verbose=False
             )
 
         elif model_type == "heavy":
-            if self.heavy_model: return
-            
-            # Unload light if loaded
-            if self.light_model:
-                logger.info("Unloading Light Model to free RAM...")
-                del self.light_model
-                self.light_model = None
-                
             logger.info("Loading Heavy Model (Phi-3.5/LLaVA)...")
             path = self._get_model_path(settings.LOCAL_MODEL_HEAVY_REPO, settings.LOCAL_MODEL_HEAVY_FILENAME)
-            
-            self.heavy_model = Llama(
+
+            # 2048 ctx is plenty: one image, a short user message and <=300
+            # output tokens. Halving ctx halves KV-cache RAM. Threads match
+            # physical cores (cpu_count reports SMT siblings, which contend
+            # for the same FPUs); smaller batch/ubatch keeps prefill tiles
+            # cache-resident on low-RAM hosts.
+            self._models["heavy"] = Llama(
                 model_path=path,
-                n_ctx=4096,
-                n_gpu_layers=0,
+                n_ctx=2048,
+                n_gpu_layers=settings.N_GPU_LAYERS,
+                n_threads=max(1, (os.cpu_count() or 2) // 2),
+                n_batch=256,
+                n_ubatch=128,
+                use_mmap=True,
+                use_mlock=False,
                 verbose=True
             )
 
-    def analyze_image(self, image_bytes: bytes, deep_search: bool = False) -> dict:
+        else:
+            return
+
+        self._enable_prompt_cache(self._models[model_type])
+
+        if self._prefetch_mm.get(model_type) is None:
+            self._prefetch_mm[model_type] = self._prefetch_pages(path)
+
+    def _enable_prompt_cache(self, model):
+        """Attach an in-RAM prompt cache so the shared system-prompt prefix
+        is prefilled once per model load, not once per request. State shape
+        is model-specific, so each Llama instance gets its own cache."""
+        try:
+            from llama_cpp import LlamaRAMCache
+            model.set_cache(LlamaRAMCache())
+        except Exception as e:
+            # Older llama-cpp-python builds lack the cache API; prefill
+            # simply stays per-request in that case.
+            logger.warning(f"Prompt cache unavailable: {e}")
+
+    async def analyze_image(self, image_bytes: bytes, deep_search: bool = False) -> dict:
         """
         Analyzes image using local model.
         deep_search=False -> Light Model (<5s)
         deep_search=True -> Heavy Model (>10s)
+
+        Inference and model loading are CPU/disk-bound llama.cpp calls, so
+        both run via asyncio.to_thread to keep the event loop responsive.
         """
-        import base64
-        
         target_model_type = "heavy" if deep_search else "light"
-        if not self.ensure_models_available(download_missing=True):
+        # First failsafe trigger may download multi-GB GGUFs; keep that off
+        # the event loop like the load/inference calls below.
+        models_ready = await asyncio.to_thread(
+            self.ensure_models_available, download_missing=True
+        )
+        if not models_ready:
             logger.error("Local failsafe models are not available and could not be downloaded.")
             return {
                 "overall_description": "Local failsafe models are missing. Please download them (see README).",
@@ -118,21 +338,25 @@ class LocalIntelligenceClient:
                 "items": [],
                 "note": "Failsafe unavailable"
             }
-        self._load_model(target_model_type)
-        model = self.heavy_model if deep_search else self.light_model
-        
-        # Prepare Image
-        base64_image = base64.b64encode(image_bytes).decode('utf-8')
-        image_url = f"data:image/jpeg;base64,{base64_image}"
-        
-        system_prompt = (
-            "You are a food AI. Identify food items and estimate calories. "
-            "Return JSON with keys: 'overall_description', 'items' (list of {name, nutrition}), 'total_calories_estimate'. "
-            "Keep description brief."
-        )
+        async with self._load_lock:
+            await asyncio.to_thread(self._load_model, target_model_type)
+        model = self._models[target_model_type]
         
+        # Prepare Image. Prefer handing the handler raw bytes: base64 is 33%
+        # larger and llama-cpp decodes it straight back to bytes, so encoding
+        # is pure wasted allocation. Older llama-cpp-python versions only
+        # accept data: URLs, so fall back to base64 when the raw-bytes entry
+        # point is missing.
+        supports_raw_images = hasattr(model, "create_chat_completion_with_images")
+        if supports_raw_images:
+            image_url = "__raw__"  # placeholder; bytes attached via images=[...]
+        else:
+            base64_image = base64.b64encode(image_bytes).decode('utf-8')
+            image_url = f"data:image/jpeg;base64,{base64_image}"
+
+
         messages = [
-            {"role": "system", "content": system_prompt},
+            {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": [
                 {"type": "text", "text": "Analyze this food."},
                 {"type": "image_url", "image_url": {"url": image_url}}
@@ -140,11 +364,21 @@ class LocalIntelligenceClient:
         ]
 
         try:
-            response = model.create_chat_completion(
-                messages=messages,
-                max_tokens=300 if deep_search else 150,
-                temperature=0.2
-            )
+            if supports_raw_images:
+                response = await asyncio.to_thread(
+                    model.create_chat_completion_with_images,
+                    messages=messages,
+                    images=[image_bytes],
+                    max_tokens=300 if deep_search else 150,
+                    temperature=0.2
+                )
+            else:
+                response = await asyncio.to_thread(
+                    model.create_chat_completion,
+                    messages=messages,
+                    max_tokens=300 if deep_search else 150,
+                    temperature=0.2
+                )
             content = response["choices"][0]["message"]["content"]
             
             # Use basic string parsing if JSON is messy (common in small models)
@@ -162,15 +396,13 @@ class LocalIntelligenceClient:
 
     def _parse_local_response(self, content: str) -> dict:
         """Attempts to parse JSON from local model output."""
-        try:
-            start = content.find('{')
-            end = content.rfind('}') + 1
-            if start != -1 and end != -1:
-                json_str = content[start:end]
-                return json.loads(json_str)
-        except Exception:
-            pass
-            
+        span = _extract_first_json_object(content.encode("utf-8", "ignore"))
+        if span is not None:
+            try:
+                return orjson.loads(span)
+            except orjson.JSONDecodeError:
+                logger.warning("Local model emitted a brace-balanced but invalid JSON span")
+
         # Fallback if valid JSON not found
         return {
             "overall_description": content[:200] + "...",
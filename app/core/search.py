@@ -1,6 +1,10 @@
 import asyncio
+import hashlib
 import time
 import httpx
+import ijson
+import orjson
+from diskcache import Cache
 from loguru import logger
 from app.config import settings
 from async_lru import alru_cache
@@ -10,20 +14,108 @@ class SerpAPIWrapper:
         self.api_key = settings.SERPAPI_API_KEY
         self.base_url = "https://serpapi.com/search"
         self._lock = asyncio.Lock()
-        self._last_request_ts = 0.0
+        self._next_allowed_ts = 0.0
         # Use the configured minimum interval for throttling. If a lower bound is required, enforce it in config.py and document it there.
         self.min_interval = settings.SERPAPI_MIN_INTERVAL
         self.max_retries = max(0, settings.SERPAPI_MAX_RETRIES)
         self.backoff_factor = max(1.0, settings.SERPAPI_BACKOFF_FACTOR)
+        # Pooled client: keep-alive (and HTTP/2 multiplexing) avoids a fresh
+        # TCP+TLS handshake to serpapi.com on every request and retry.
+        self._client = httpx.AsyncClient(
+            timeout=10.0,
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=10, max_connections=20),
+        )
+        # L2 cache: SQLite-backed, survives restarts (the alru_cache on
+        # search_food_info is L1 and evaporates with the process).
+        self._disk_cache = Cache(settings.SERPAPI_CACHE_DIR)
+
+    async def close(self):
+        """Closes the pooled HTTP client and disk cache. Wired to FastAPI shutdown."""
+        await self._client.aclose()
+        self._disk_cache.close()
+
+    @staticmethod
+    def _cache_key(query: str) -> str:
+        return hashlib.blake2b(query.encode()).hexdigest()
+
+    class _StreamReader:
+        """Adapts an httpx byte iterator to the async read(n) ijson expects."""
+
+        def __init__(self, aiter):
+            self._aiter = aiter
+            self._buf = b""
+
+        async def read(self, n: int) -> bytes:
+            while len(self._buf) < n:
+                try:
+                    self._buf += await self._aiter.__anext__()
+                except StopAsyncIteration:
+                    break
+            out, self._buf = self._buf[:n], self._buf[n:]
+            return out
+
+    async def _stream_trimmed_results(self, response) -> dict:
+        """Incrementally parses a SerpAPI response into the trimmed shape.
+
+        The full payload can run to hundreds of KB but we only keep the
+        knowledge graph and the top-3 organic results, so events are consumed
+        as bytes arrive and the stream is abandoned early once both are in
+        hand — the tail is never buffered or parsed.
+        """
+        results = {"snippets": [], "knowledge_graph": {}}
+        kg_done = False
+        builder = None       # active ijson.ObjectBuilder
+        builder_root = None  # prefix whose end_map completes the builder
+
+        # use_float keeps numbers as plain floats; ijson's default Decimal
+        # events would break orjson/json serialization downstream.
+        async for prefix, event, value in ijson.parse(self._StreamReader(response.aiter_bytes()), use_float=True):
+            if builder is not None:
+                builder.event(event, value)
+                if prefix == builder_root and event == "end_map":
+                    if builder_root == "knowledge_graph":
+                        results["knowledge_graph"] = builder.value
+                        kg_done = True
+                    else:
+                        res = builder.value
+                        results["snippets"].append({
+                            "title": res.get("title"),
+                            "snippet": res.get("snippet"),
+                            "link": res.get("link")
+                        })
+                    builder = None
+            elif prefix == "knowledge_graph" and event == "start_map":
+                builder = ijson.ObjectBuilder()
+                builder.event(event, value)
+                builder_root = prefix
+            elif prefix == "organic_results.item" and event == "start_map" and len(results["snippets"]) < 3:
+                builder = ijson.ObjectBuilder()
+                builder.event(event, value)
+                builder_root = prefix
+
+            if kg_done and len(results["snippets"]) >= 3:
+                break  # leaving the stream context closes the connection early
+
+        return results
 
     async def _throttle(self):
-        """Ensure a minimum delay between outbound SerpAPI calls."""
+        """Ensure a minimum delay between outbound SerpAPI calls.
+
+        Each caller claims the next free time slot under the lock (a cheap
+        read-compute-write, never a sleep) and then waits for its own slot
+        outside the lock. Unthrottled callers pass straight through instead
+        of queueing behind someone else's sleep, while the min_interval
+        spacing between slots is preserved.
+        """
         async with self._lock:
             now = time.monotonic()
-            wait = self.min_interval - (now - self._last_request_ts)
-            if wait > 0:
-                await asyncio.sleep(wait)
-            self._last_request_ts = time.monotonic()
+            my_slot = max(now, self._next_allowed_ts)
+            self._next_allowed_ts = my_slot + self.min_interval
+
+        wait = my_slot - now
+        if wait > 0:
+            await asyncio.sleep(wait)
 
     def _should_retry(self, attempt: int) -> bool:
         return attempt < self.max_retries
@@ -33,7 +125,11 @@ class SerpAPIWrapper:
         return backoff * self.backoff_factor
 
     async def _request_with_retry(self, params: dict):
-        """Throttled SerpAPI call with retry/backoff. Returns (data, status, detail)."""
+        """Throttled, streamed SerpAPI call with retry/backoff.
+
+        Returns (results, status, detail) where results is already in the
+        trimmed snippets/knowledge_graph shape.
+        """
         backoff = self.min_interval
         last_status = None
         last_detail = None
@@ -41,33 +137,34 @@ class SerpAPIWrapper:
         for attempt in range(self.max_retries + 1):
             await self._throttle()
 
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(self.base_url, params=params)
-
-            last_status = response.status_code
-            last_detail = response.text[:300] if response.text else None
-
-            if response.status_code >= 400:
-                logger.warning(
-                    f"SerpAPI {response.status_code} received; backing off {backoff:.2f}s (attempt {attempt+1}/{self.max_retries})"
-                )
-
-                if self._should_retry(attempt):
-                    backoff = await self._sleep_with_backoff(backoff)
-                    continue
-
-                return None, last_status, last_detail
-
-            try:
-                data = response.json()
-            except ValueError:
-                logger.error("SerpAPI response JSON decode failed")
-                if self._should_retry(attempt):
-                    backoff = await self._sleep_with_backoff(backoff)
-                    continue
-                return None, last_status, "invalid json"
-
-            return data, last_status, last_detail
+            retry_needed = False
+            async with self._client.stream("GET", self.base_url, params=params) as response:
+                last_status = response.status_code
+
+                if response.status_code >= 400:
+                    body = await response.aread()
+                    last_detail = body[:300].decode("utf-8", "ignore") if body else None
+                    logger.warning(
+                        f"SerpAPI {response.status_code} received; backing off {backoff:.2f}s (attempt {attempt+1}/{self.max_retries})"
+                    )
+                    retry_needed = True
+                else:
+                    try:
+                        results = await self._stream_trimmed_results(response)
+                    except ijson.common.JSONError:
+                        logger.error("SerpAPI response JSON decode failed")
+                        last_detail = "invalid json"
+                        retry_needed = True
+                    else:
+                        return results, last_status, last_detail
+
+            # Backoff happens outside the stream context so the connection
+            # isn't held open across the sleep.
+            if retry_needed and self._should_retry(attempt):
+                backoff = await self._sleep_with_backoff(backoff)
+                continue
+
+            return None, last_status, last_detail
 
         return None, last_status, last_detail
 
@@ -81,8 +178,16 @@ class SerpAPIWrapper:
             logger.warning("SerpAPI Key is missing. Skipping web search.")
             return {"error": "API Key missing"}
 
+        # L2: check disk before going to the network (diskcache is a blocking
+        # SQLite read, so run it off the event loop)
+        cache_key = self._cache_key(query)
+        cached = await asyncio.to_thread(self._disk_cache.get, cache_key)
+        if cached is not None:
+            logger.info(f"SerpAPI disk-cache hit for: {query}")
+            return orjson.loads(cached)
+
         logger.info(f"Searching SerpAPI for: {query}")
-        
+
         params = {
             "engine": "google",
             "q": query,
@@ -92,29 +197,23 @@ class SerpAPIWrapper:
         }
 
         try:
-            data, last_status, last_detail = await self._request_with_retry(params)
+            results, last_status, last_detail = await self._request_with_retry(params)
 
-            if data is None:
+            if results is None:
                 return {
                     "error": "SerpAPI request failed after retries",
                     "status": last_status,
                     "detail": last_detail,
                 }
-            
-            # RAM Efficiency: Extract only what's needed, discard the rest
-            results = {
-                "snippets": [],
-                "knowledge_graph": data.get("knowledge_graph", {})
-            }
 
-            if "organic_results" in data:
-                for res in data["organic_results"][:3]: # Limit to top 3
-                    results["snippets"].append({
-                        "title": res.get("title"),
-                        "snippet": res.get("snippet"),
-                        "link": res.get("link")
-                    })
-            
+            # Persist successful results so restarts don't re-spend quota
+            await asyncio.to_thread(
+                self._disk_cache.set,
+                cache_key,
+                orjson.dumps(results),
+                settings.SERPAPI_CACHE_TTL,
+            )
+
             return results
 
         except httpx.HTTPError as e:
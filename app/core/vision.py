@@ -126,8 +126,10 @@ async def analyze_food_image_with_search(image_bytes: bytes, deep_search: bool =
         logger.warning(f"Cloud API/Search failed: {e}. Switching to Local Failsafe. Deep Search: {deep_search}")
         try:
             # Fallback to Local Intelligence
-            local_client.ensure_models_available(download_missing=True)
-            return local_client.analyze_image(image_bytes, deep_search=deep_search)
+            await asyncio.to_thread(
+                local_client.ensure_models_available, download_missing=True
+            )
+            return await local_client.analyze_image(image_bytes, deep_search=deep_search)
         except Exception as local_e:
             logger.critical(f"Local Failsafe also failed: {local_e}")
             raise HTTPException(status_code=500, detail="All AI systems failed.")
@@ -1,9 +1,22 @@
+import asyncio
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.routers import food
 from app.config import settings
+from app.core.local_intelligence import local_client
+from app.core.search import search_client
 from loguru import logger
 
+# uvloop: drop-in asyncio event loop that speeds up the whole async
+# pipeline (httpx calls, parallel searches) for free. Not available on
+# Windows, so fall back to the default loop there.
+try:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    uvloop = None
+
 # Initialize Logging
 logger.add("server.log", rotation="500 MB", level="INFO")
 
@@ -25,6 +38,20 @@ app.add_middleware(
 # Include Routers
 app.include_router(food.router, prefix="/api/v1/food", tags=["Food Analysis"])
 
+@app.on_event("startup")
+async def warmup_local_models():
+    # Warm both failsafe GGUFs into the page cache in the background so a
+    # deep_search toggle never pays a cold disk read. Doesn't block startup.
+    # The reference is kept on app.state: the loop only holds a weak
+    # reference to tasks, so a bare create_task could be collected mid-run.
+    app.state.warmup_task = asyncio.create_task(
+        asyncio.to_thread(local_client.warmup_prefetch)
+    )
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    await search_client.close()
+
 @app.get("/")
 def health_check():
     return {
@@ -35,4 +62,11 @@ def health_check():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        reload=True,
+        loop="uvloop" if uvloop else "auto",
+        http="httptools",
+    )
\ No newline at end of file
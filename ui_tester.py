@@ -1,8 +1,10 @@
+import asyncio
 import os
-import json
 import io
 import gradio as gr
 import httpx
+import orjson
+from PIL import Image
 from loguru import logger
 
 # Setup logging for the UI
@@ -11,6 +13,10 @@ logger.add("ui_debug.log", rotation="10 MB")
 NGROK_SAMPLE = "https://sleepier-cammy-prejudiciable.ngrok-free.dev"
 DEFAULT_API_BASE = os.getenv("API_BASE_URL", NGROK_SAMPLE)
 
+# Shared client so repeated uploads reuse the same keep-alive connection
+# instead of paying a TCP+TLS handshake per call.
+_http_client = httpx.AsyncClient(timeout=60.0)
+
 
 def _format_table(payload: dict) -> str:
     """Create a nutrition-label style markdown table from API payload."""
@@ -39,6 +45,15 @@ def _format_table(payload: dict) -> str:
     return "\n".join(lines)
 
 
+def _encode_jpeg(image) -> bytes:
+    """Downscale + recompress for upload. Pure libjpeg/PIL work, meant to be
+    run off the event loop via asyncio.to_thread."""
+    image.thumbnail((1024, 1024), Image.LANCZOS)
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG", quality=85, optimize=True, progressive=True)
+    return buf.getvalue()
+
+
 async def call_api(image, deep_search: bool, api_base_url: str):
     if image is None:
         return "Please upload an image.", ""
@@ -48,22 +63,24 @@ async def call_api(image, deep_search: bool, api_base_url: str):
     url = f"{api_base}/api/v1/food/analyze"
 
     try:
-        # Convert PIL image to bytes
-        img_byte_arr = io.BytesIO()
-        image.save(img_byte_arr, format="JPEG")
-        image_bytes = img_byte_arr.getvalue()
+        # Downscale + recompress before upload: phone photos are often >5MB,
+        # which bloats both the POST and the server-side base64 for the local
+        # vision model. 1024px at quality 85 also makes the server's
+        # _resize_image a no-op fast path. The encode is 50-200ms of blocking
+        # libjpeg work, so it runs in a thread to keep Gradio responsive.
+        image_bytes = await asyncio.to_thread(_encode_jpeg, image)
 
         files = {"file": ("upload.jpg", image_bytes, "image/jpeg")}
         data = {"deep_search": str(deep_search).lower()}
 
         logger.info(f"Calling API at {url} (deep_search={deep_search})")
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            resp = await client.post(url, files=files, data=data)
-            if resp.status_code != 200:
-                logger.error(f"API error {resp.status_code}: {resp.text}")
-                return f"HTTP {resp.status_code}: {resp.text}", ""
-            payload = resp.json()
-            return json.dumps(payload, indent=2), _format_table(payload)
+        resp = await _http_client.post(url, files=files, data=data)
+        if resp.status_code != 200:
+            logger.error(f"API error {resp.status_code}: {resp.text}")
+            return f"HTTP {resp.status_code}: {resp.text}", ""
+        payload = resp.json()
+        pretty = orjson.dumps(payload, option=orjson.OPT_INDENT_2).decode()
+        return pretty, _format_table(payload)
     except Exception as e:
         logger.error(f"UI Error: {e}")
         return f"Error: {str(e)}", ""